@@ -1,33 +1,138 @@
-import bpy, bmesh
+import bpy, bmesh, logging
+import numpy as np
 from bpy import data as D
 from bpy import context as C
 from bpy import ops as O
-from mathutils import Vector
+from mathutils import Matrix, Vector
 
-# Gets object of given name
-# ParamsL
-#   obj_name - name of object required
+logger = logging.getLogger(__name__)
+
+# Template geometry, as flat arrays ready for foreach_set
+# Plane matching primitive_plane_add: 2x2, facing up
+_PLANE_VERTS = np.array([(-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, 1, 0)], dtype=np.float32).ravel()
+_PLANE_LOOPS = np.array([0, 1, 2, 3], dtype=np.int32)
+_PLANE_LOOP_TOTALS = np.array([4], dtype=np.int32)
+
+# Circle matching primitive_circle_add: 32 vertices, radius 1, edges only
+_circle_angles = np.linspace(0, 2 * np.pi, 32, endpoint=False)
+_CIRCLE_VERTS = np.column_stack((np.cos(_circle_angles), np.sin(_circle_angles),
+                                 np.zeros(32))).astype(np.float32).ravel()
+_CIRCLE_EDGES = np.column_stack((np.arange(32), (np.arange(32) + 1) % 32)).astype(np.int32).ravel()
+_NO_LOOPS = np.zeros(0, dtype=np.int32)
+
+# Cylinder template arrays, by number of sides
+_cylinder_templates = {}
+
+# Gets template arrays for a cylinder like primitive_cylinder_add: radius 1,
+# depth 2, first ring of vertices at the bottom and second at the top
+# Params:
+#   segments - number of sides
 # Return:
-#   Object of name given
-def get_object(obj_name):
-    for obj in C.scene.objects:
-        if obj.name == obj_name:
-            return obj
-    
-    # If not found
-    print("Object named", obj_name, "not found.")
-    return 0
+#   verts, loops, loop_totals arrays, see template_mesh
+def cylinder_template(segments):
+    if segments not in _cylinder_templates:
+        angles = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+        ring = np.column_stack((np.cos(angles), np.sin(angles)))
+        verts = np.vstack((np.column_stack((ring, np.full(segments, -1.0))),
+                           np.column_stack((ring, np.full(segments, 1.0))))).astype(np.float32).ravel()
+        i = np.arange(segments)
+        j = (i + 1) % segments
+        loops = np.concatenate((np.column_stack((i, j, j + segments, i + segments)).ravel(),
+                                np.arange(segments, 2 * segments),   # Top cap
+                                np.arange(segments - 1, -1, -1)))    # Bottom cap
+        loop_totals = np.array([4] * segments + [segments, segments], dtype=np.int32)
+        _cylinder_templates[segments] = (verts, loops.astype(np.int32), loop_totals)
+
+    return _cylinder_templates[segments]
+
+# Shared mesh used by every marble; built on first use
+_marble_mesh = None
+
+# Shared meshes used by every support that isn't reshaped afterwards, by number of sides
+_support_meshes = {}
+
+# Shared meshes used by every plain cylinder (hole cutters, ramps), by number of sides
+_cylinder_meshes = {}
+
+# Checks whether a mesh is one of the shared meshes cached above
+# Params:
+#   me - mesh to check
+# Return:
+#   True if the mesh is cached, so it must outlive the objects using it
+def is_template_mesh(me):
+    return me == _marble_mesh or me in _support_meshes.values() or me in _cylinder_meshes.values()
+
+# Rigid bodies to add once the maze is built, as (object, type, settings) tuples
+_pending_rigid_bodies = []
 
-# Selects object of given name
+# Links object into scene; selection is left untouched
 # Params:
-#   obj_name - name of object to be selected
+#   obj - object to be linked
 # Return:
-#   Object selected
-def select_object(obj_name):
-    obj = get_object(obj_name)
-    obj.select_set(True)
+#   Object linked
+def link_object(obj):
+    C.scene.collection.objects.link(obj)
     return obj
 
+# Converts a maze location to a scene location; each maze level is 1.5 high
+# Params:
+#   loc_vec - location in maze
+# Return:
+#   Vector of scene location
+def mod_location(loc_vec):
+    return Vector((loc_vec[0], loc_vec[1], (loc_vec[2] * 1.5) + 0.75))
+
+# Creates an object using given mesh and links it into the scene
+# Params:
+#   name - name of object
+#   me - mesh used by object
+#   loc_vec - location of object
+# Return:
+#   Created object
+def create_object(name, me, loc_vec):
+    obj = D.objects.new(name, me)
+    obj.location = loc_vec
+    return link_object(obj)
+
+# Creates a mesh from template arrays using foreach_set
+# Params:
+#   name - name of mesh
+#   verts - flat array of vertex coordinates
+#   loops - flat array of vertex indices, face after face
+#   loop_totals - number of vertices in each face, used to find where each starts
+#   scl - x,y,z scale applied to the vertices
+#   edges - flat array of loose edge vertex pairs, if any
+# Return:
+#   Created mesh
+def template_mesh(name, verts, loops, loop_totals, scl=(1, 1, 1), edges=None):
+    verts = (verts.reshape(-1, 3) * np.array(scl, dtype=np.float32)).ravel()
+    loop_starts = np.cumsum(loop_totals, dtype=np.int32) - loop_totals
+
+    me = D.meshes.new(name)
+    me.vertices.add(len(verts) // 3)
+    me.vertices.foreach_set("co", verts)
+    if edges is not None:
+        me.edges.add(len(edges) // 2)
+        me.edges.foreach_set("vertices", edges)
+    me.loops.add(len(loops))
+    me.loops.foreach_set("vertex_index", loops)
+    me.polygons.add(len(loop_totals))
+    me.polygons.foreach_set("loop_start", loop_starts)
+    me.update(calc_edges=True)
+
+    return me
+
+# Creates a mesh object from template arrays
+# Params:
+#   name - name of object and its mesh
+#   verts, loops, loop_totals - template arrays, see template_mesh
+#   loc_vec - location of object
+#   scl - x,y,z scale applied to the vertices
+# Return:
+#   Created object
+def create_template_object(name, verts, loops, loop_totals, loc_vec, scl=(1, 1, 1)):
+    return create_object(name, template_mesh(name, verts, loops, loop_totals, scl), loc_vec)
+
 # Creates a plane using given parameters
 # Params:
 #   name - name of plane
@@ -36,19 +141,11 @@ def select_object(obj_name):
 # Return:
 #   Created plane object 
 def create_plane(name, loc_vec, x_scl, y_scl):
-    print("Creating plane...")
-    z_mod = (loc_vec[2] * 1.5) + 0.75
-    loc_vec_modded = [loc_vec[0], loc_vec[1], z_mod]
-    O.mesh.primitive_plane_add(location=loc_vec_modded)
-    O.transform.resize(value=(x_scl, y_scl, 0))
-    
-    # Set plane's name to name
-    for obj in C.selected_objects:
-        if (obj.type == "MESH") and (obj.name == "Plane"):
-            obj.name = name
-            break
+    logger.debug("Creating plane %s...", name)
+    loc_vec_modded = mod_location(loc_vec)
 
-    return obj
+    return create_template_object(name, _PLANE_VERTS, _PLANE_LOOPS, _PLANE_LOOP_TOTALS,
+                                  loc_vec_modded, (x_scl, y_scl, 0))
 
 # Creates a circle using given parameters
 # Params:
@@ -58,19 +155,11 @@ def create_plane(name, loc_vec, x_scl, y_scl):
 # Return:
 #   Created circle object 
 def create_circle(name, loc_vec, x_scl, y_scl):
-    print("Creating circle...")
-    z_mod = (loc_vec[2] * 1.5) + 0.75
-    loc_vec_modded = [loc_vec[0], loc_vec[1], z_mod]
-    O.mesh.primitive_circle_add(location=loc_vec_modded)
-    O.transform.resize(value=(x_scl, y_scl, 0))
-    
-    # Set circle's name to name
-    for obj in C.selected_objects:
-        if (obj.type == "MESH") and (obj.name == "Circle"):
-            obj.name = name
-            break
+    logger.debug("Creating circle %s...", name)
+    loc_vec_modded = mod_location(loc_vec)
+    me = template_mesh(name, _CIRCLE_VERTS, _NO_LOOPS, _NO_LOOPS, (x_scl, y_scl, 0), _CIRCLE_EDGES)
 
-    return obj
+    return create_object(name, me, loc_vec_modded)
 
 # Creates a camera in the scene
 # Params:
@@ -79,7 +168,7 @@ def create_circle(name, loc_vec, x_scl, y_scl):
 # Return:
 #   camera object created
 def add_camera(camera_name, loc_vec):
-    print("Adding camera", camera_name, "; loc =", loc_vec)
+    logger.debug("Adding camera %s; loc = %s", camera_name, loc_vec)
     scn = C.scene
 
     # create the camera
@@ -106,28 +195,73 @@ def look_at(obj_camera, point):
     # point the cameras '-Z' and use its 'Y' as up
     rot_quat = direction.to_track_quat('-Z', 'Y')
 
-    # assume we're using euler rotation
-    obj_camera.rotation_euler = rot_quat.to_euler()
+    # use quaternion rotation directly rather than converting to euler
+    obj_camera.rotation_mode = 'QUATERNION'
+    obj_camera.rotation_quaternion = rot_quat
 
-# Selects all meshes in scene
+# Works out look_at rotations for many cameras at once
 # Params:
-#   Nothing
+#   cam_positions - (N, 3) array of camera locations, or a single x,y,z location
+#   target - x,y,z coordinates all cameras look at
+# Return:
+#   (N, 3) array of XYZ euler rotations pointing each camera's '-Z' at target,
+#   with its 'Y' as up; assign to rotation_euler with rotation_mode 'XYZ'.
+#   A camera straight above or below target keeps its 'Y' along world Y, and
+#   a camera sitting on target looks straight down
+def look_at_batch(cam_positions, target):
+    cam_positions = np.atleast_2d(np.asarray(cam_positions, dtype=np.float64))
+    direction = np.asarray(target, dtype=np.float64) - cam_positions
+    length = np.linalg.norm(direction, axis=1, keepdims=True)
+
+    # A camera on the target has no direction to look in
+    on_target = length[:, 0] < 1e-8
+    direction[on_target] = (0.0, 0.0, -1.0)
+    length[on_target] = 1.0
+    direction /= length
+
+    # Camera basis: local Z points away from target, local X stays level
+    z_axis = -direction
+    x_axis = np.cross((0.0, 0.0, 1.0), z_axis)
+
+    # Looking straight up or down leaves no level X axis; build it from world Y instead
+    vertical = np.linalg.norm(x_axis, axis=1) < 1e-8
+    x_axis[vertical] = np.cross((0.0, 1.0, 0.0), z_axis[vertical])
+    x_axis /= np.linalg.norm(x_axis, axis=1, keepdims=True)
+    y_axis = np.cross(z_axis, x_axis)
+
+    # Rotation matrix columns are the basis vectors; XYZ euler is R = Rz @ Ry @ Rx
+    rot_x = np.arctan2(y_axis[:, 2], z_axis[:, 2])
+    rot_y = np.arctan2(-x_axis[:, 2], np.hypot(x_axis[:, 0], x_axis[:, 1]))
+    rot_z = np.arctan2(x_axis[:, 1], x_axis[:, 0])
+
+    return np.column_stack((rot_x, rot_y, rot_z))
+
+# Applies a rotation/scale about the object's origin, then a move, in one
+# matrix assignment; replaces chains of transform.rotate/resize/translate
+# Only pass a scale that is uniform, or that comes before any rotation
+# (e.g. R @ S on an unrotated object); otherwise the result is sheared, use
+# resize_object instead
+# Params:
+#   obj - object to transform
+#   mat - 4x4 rotation/scale matrix in global axes
+#   vec - x,y,z offset applied afterwards
 # Return:
 #   Nothing
-def select_all_meshes():
-    for obj in C.scene.objects:
-        if obj.type == "MESH":
-            obj.select_set(True)
+def transform_object(obj, mat, vec=(0, 0, 0)):
+    pivot = obj.matrix_basis.to_translation()
+    obj.matrix_basis = (Matrix.Translation(pivot + Vector(vec)) @ mat
+                        @ Matrix.Translation(-pivot) @ obj.matrix_basis)
 
-# Deelects all meshes in scene
+# Scales object along global axes like transform.resize in object mode, which
+# only changes the object's local scale and never its rotation
 # Params:
-#   Nothing
+#   obj - object to scale
+#   scl - x,y,z scale
 # Return:
 #   Nothing
-def deselect_all_meshes():
-    for obj in C.scene.objects:
-        if obj.type == "MESH":
-            obj.select_set(False)
+def resize_object(obj, scl):
+    mat = Matrix.Diagonal(scl) @ obj.matrix_basis.to_3x3()
+    obj.scale = [col.length for col in mat.col]
 
 # Removes all meshes in scene
 # Params:
@@ -135,29 +269,89 @@ def deselect_all_meshes():
 # Return:
 #   Nothing
 def remove_all_meshes():
-    select_all_meshes()
-    O.object.delete()
+    global _marble_mesh
+
+    # Remove mesh objects, then the meshes they leave unused, one batch each
+    D.batch_remove(ids=[obj for obj in D.objects if obj.type == "MESH"])
+    D.batch_remove(ids=[me for me in D.meshes if me.users == 0])
+    _pending_rigid_bodies.clear()
+    _marble_mesh = None
+    _support_meshes.clear()
+    _cylinder_meshes.clear()
 
     return
 
+# Deletes a mesh object created by this script
+# Params:
+#   obj - object to be deleted
+# Return:
+#   Nothing
+def delete_object(obj):
+    _pending_rigid_bodies[:] = [rb for rb in _pending_rigid_bodies if rb[0] != obj]
+    me = obj.data
+    D.objects.remove(obj, do_unlink=True)
+
+    # Keep meshes still shared with other objects, and cached meshes that later
+    # objects will reuse even when nothing uses them right now
+    if me.users == 0 and not is_template_mesh(me):
+        D.meshes.remove(me, do_unlink=True)
+
+# Queues a rigid body to be added to an object by apply_rigid_bodies
+# Params:
+#   obj - object to receive rigid body
+#   rb_type - rigid body type, 'ACTIVE' or 'PASSIVE'
+#   settings - rigid body properties to set, e.g. friction=0.1
+# Return:
+#   Nothing
+def add_rigid_body(obj, rb_type, **settings):
+    _pending_rigid_bodies.append((obj, rb_type, settings))
+
+# Adds all queued rigid bodies, one operator call per rigid body type
+# Params:
+#   Nothing
+# Return:
+#   Nothing
+def apply_rigid_bodies():
+    if C.scene.rigidbody_world is None:
+        O.rigidbody.world_add()
+
+    for rb_type in ('PASSIVE', 'ACTIVE'):
+        objs = [obj for obj, t, settings in _pending_rigid_bodies if t == rb_type]
+        if objs:
+            with C.temp_override(object=objs[0], active_object=objs[0], selected_objects=objs):
+                O.rigidbody.objects_add(type=rb_type)
+
+    for obj, t, settings in _pending_rigid_bodies:
+        for key, value in settings.items():
+            setattr(obj.rigid_body, key, value)
+
+    _pending_rigid_bodies.clear()
+
 # Adds boolean operator between two meshes in a scene
 # Params:
 #   mesh_1 - mesh object to receive boolean modifier
 #   mesh_2 - mesh object used as boolean modifier
 #   bool_op - boolean operator to add
+#   solver - 'EXACT', or 'FAST' for simple primitive cuts with no coplanar faces
 # Return:
-#   Result of bool operation
-def bool_meshes(mesh_1, mesh_2, bool_op):
-    name_1 = mesh_1.name
-    name_2 = mesh_2.name
-    mod = D.objects[name_1].modifiers.new('Boolean', type='BOOLEAN')
+#   mesh_1, with the boolean baked into its mesh
+def bool_meshes(mesh_1, mesh_2, bool_op, solver='EXACT'):
+    mod = mesh_1.modifiers.new('Boolean', type='BOOLEAN')
     mod.operation = bool_op
-    mod.object = D.objects[name_2]
-    C.view_layer.objects.active = bpy.data.objects[name_1]
-    # Apply the modifier.
-    res = O.object.modifier_apply(modifier = 'Boolean')
+    mod.object = mesh_2
+    mod.solver = solver
+
+    # Bake the evaluated result into a new mesh rather than using modifier_apply
+    depsgraph = C.evaluated_depsgraph_get()
+    old_me = mesh_1.data
+    mesh_1.data = D.meshes.new_from_object(mesh_1.evaluated_get(depsgraph))
+    mesh_1.modifiers.remove(mod)
 
-    return res
+    if old_me.users == 0 and not is_template_mesh(old_me):
+        D.meshes.remove(old_me, do_unlink=True)
+    mesh_1.data.name = mesh_1.name
+
+    return mesh_1
 
 # Unionizes 2 meshes, deletes mesh that was unioned in
 # Params:
@@ -166,11 +360,44 @@ def bool_meshes(mesh_1, mesh_2, bool_op):
 # Return:
 #   Result of union
 def unionize_meshes(mesh_1, mesh_2):
-    select_object(mesh_1.name)
     bool_meshes(mesh_1, mesh_2, 'UNION')
-    deselect_all_meshes()
-    select_object(mesh_2.name)
-    O.object.delete()
+    delete_object(mesh_2)
+    return mesh_1
+
+# Joins geometry of mesh_2 into mesh_1 without a boolean, deletes mesh_2
+# Overlapping parts are kept as they are, so only use on pieces that just touch
+# or whose overlap doesn't matter
+# Params:
+#   mesh_1 - main mesh object
+#   mesh_2 - mesh object to be joined onto mesh_1
+# Return:
+#   mesh_1
+def join_meshes(mesh_1, mesh_2):
+    if mesh_1.data.users > 1:
+        mesh_1.data = mesh_1.data.copy()
+
+    # from_mesh appends, so both meshes end up in one BMesh
+    bm = bmesh.new()
+    bm.from_mesh(mesh_1.data)
+    vert_count = len(bm.verts)
+    bm.from_mesh(mesh_2.data)
+    bm.verts.ensure_lookup_table()
+
+    # Move mesh_2's vertices into mesh_1's local space
+    bmesh.ops.transform(bm, matrix=mesh_1.matrix_basis.inverted() @ mesh_2.matrix_basis,
+                        verts=bm.verts[vert_count:])
+
+    # Weld only across the seam: mesh_2's vertices onto mesh_1's open edges.
+    # With keep_verts, find_doubles never pairs two vertices from the same
+    # side, so neither piece's own coincident vertices get merged
+    seam_verts = [v for v in bm.verts[:vert_count] if v.is_boundary]
+    targetmap = bmesh.ops.find_doubles(bm, verts=bm.verts[vert_count:], keep_verts=seam_verts,
+                                       dist=1e-4)['targetmap']
+    bmesh.ops.weld_verts(bm, targetmap=targetmap)
+    bm.to_mesh(mesh_1.data)
+    bm.free()
+
+    delete_object(mesh_2)
     return mesh_1
 
 # Creates a marble using given parameters
@@ -181,92 +408,126 @@ def unionize_meshes(mesh_1, mesh_2):
 # Return:
 #   Created marble object 
 def create_marble(name, loc_vec, scl):
-    z_mod = (loc_vec[2] * 1.5) + 0.75
-    loc_vec_modded = [loc_vec[0], loc_vec[1], z_mod]
-    O.mesh.primitive_uv_sphere_add(location=loc_vec_modded)
-    O.transform.resize(value=(scl, scl, scl))
-    
-    # Set plane's name to name
-    for obj in C.selected_objects:
-        if (obj.type == "MESH") and (obj.name == "Sphere"):
-            obj.name = name
-            break
+    global _marble_mesh
+    loc_vec_modded = mod_location(loc_vec)
+
+    # All marbles share one UV sphere mesh (32 segments, 16 rings)
+    if _marble_mesh is None:
+        bm = bmesh.new()
+        bmesh.ops.create_uvsphere(bm, u_segments=32, v_segments=16, radius=1)
+        _marble_mesh = D.meshes.new("Marble")
+        bm.to_mesh(_marble_mesh)
+        bm.free()
+
+    obj = create_object(name, _marble_mesh, loc_vec_modded)
+    obj.scale = (scl, scl, scl)
 
-    O.rigidbody.object_add(type='ACTIVE')
+    add_rigid_body(obj, 'ACTIVE', collision_shape='SPHERE')
 
     return obj
 
+# Gets the shared cylinder mesh, building it on first use
+# Params:
+#   segments - number of sides
+# Return:
+#   Shared cylinder mesh
+def cylinder_mesh(segments=32):
+    if segments not in _cylinder_meshes:
+        _cylinder_meshes[segments] = template_mesh("Cylinder", *cylinder_template(segments))
+
+    return _cylinder_meshes[segments]
+
 # Creates cylinder at given location
 # Params:
 #   name - name for object
 #   loc_vec - location of object
+#   shared - use the shared cylinder mesh; pass False if the mesh will be edited
+#   segments - number of sides
 # Return:
 #   created object
-def create_cylinder(name, loc_vec):
-    z_mod = (loc_vec[2] * 1.5) + 0.75
-    loc_vec_modded = [loc_vec[0], loc_vec[1], z_mod]
-    O.mesh.primitive_cylinder_add(location=loc_vec_modded)
-
-    # Set name
-    for obj in C.selected_objects:
-        if (obj.type == "MESH") and (obj.name == "Cylinder"):
-            obj.name = name
-            break
-    
-    return obj
+def create_cylinder(name, loc_vec, shared=True, segments=32):
+    loc_vec_modded = mod_location(loc_vec)
 
-# Creates support tube as hollow cylinder at given location
+    if not shared:
+        return create_template_object(name, *cylinder_template(segments), loc_vec_modded)
+
+    return create_object(name, cylinder_mesh(segments), loc_vec_modded)
+
+# Creates cylinder object used only as a boolean cutter; it is never linked
+# into the scene, so it needs no selection, rigid body or scene cleanup
 # Params:
 #   name - name for object
 #   loc_vec - location of object
 # Return:
-#   created object
+#   created object, to be removed with bpy.data.objects.remove when done
+def create_cutter(name, loc_vec):
+    obj = D.objects.new(name, cylinder_mesh())
+    obj.location = mod_location(loc_vec)
+    return obj
+
+# Gets the shared support mesh, building it on first use
+# Params:
+#   segments - number of sides
+# Return:
+#   Shared support mesh
 # https://stackoverflow.com/questions/37808840/selecting-a-face-and-extruding-a-cube-in-blender-via-python-api
 # https://blender.stackexchange.com/questions/121123/using-python-and-bmesh-to-scale-resize-a-face-in-place
-def create_support(name, loc_vec):
+def support_mesh(segments):
+    if segments in _support_meshes:
+        return _support_meshes[segments]
 
-    # If an object were named the name of the mesh created, undesired behavior 
-    # would occur next time that mesh was created (Mesh.001 would be made, Mesh would be modified)
-    if (name == "Cylinder"):
-        print("Use a different name for the object.")
-        return 0
+    me = template_mesh("Support", *cylinder_template(segments), (0.5, 0.5, 0.75))
 
-    obj = create_cylinder(name, loc_vec)
+    # Top and bottom caps are the faces pointing furthest up and down
+    norms = np.empty(len(me.polygons) * 3, dtype=np.float32)
+    me.polygons.foreach_get("normal", norms)
+    norms = norms.reshape(-1, 3)
+    top_idx = int(np.argmax(norms[:, 2]))
+    bot_idx = int(np.argmin(norms[:, 2]))
 
-    O.transform.resize(value=(0.5, 0.5, 0.75))
+    bm = bmesh.new()
+    bm.from_mesh(me)
+    bm.faces.ensure_lookup_table()
+    top, bot = bm.faces[top_idx], bm.faces[bot_idx]
 
-    O.object.mode_set(mode = 'EDIT')
-    O.mesh.select_mode(type = 'FACE')
-    O.mesh.select_all(action = 'DESELECT')
-    
-    # Get a BMesh representation
-    me = obj.data
-    bm = bmesh.from_edit_mesh(me)
+    # Inset once to make the rim, then again with no thickness so the
+    # inner face can be pulled down into the tube wall
+    bmesh.ops.inset_individual(bm, faces=[top, bot], thickness=0.0625, depth=0)
+    bmesh.ops.inset_individual(bm, faces=[top, bot], thickness=0, depth=0)
 
-    # Inset faces
-    for f in bm.faces:
-        if ((f.index == 30) or (f.index == 33)): # Top and Bottom
-            f.select = True
-            O.mesh.inset(thickness=0.125) # Do it once to actually inset
-            O.mesh.inset(thickness=0) # Do it 2nd time so faces can be deleted
-            if (f.index == 30): # Top only 
-                O.transform.translate(value=(0, 0, -1.5))
-            f.select = False
+    # Top only
+    for v in top.verts:
+        v.co.z -= 1.5
+    bmesh.ops.delete(bm, geom=[top, bot], context='FACES_ONLY')
 
-    O.mesh.select_all(action = 'DESELECT')
+    bm.to_mesh(me)
+    bm.free()
 
-    for f in bm.faces:
-        if ((f.index == 30) or (f.index == 33)):
-            f.select = True    
+    _support_meshes[segments] = me
+    return me
 
-    O.mesh.delete(type='FACE')    
-    
-    O.object.mode_set(mode = 'OBJECT')
-    O.rigidbody.object_add(type='PASSIVE')
-    C.object.rigid_body.collision_shape = 'MESH'
-    C.object.rigid_body.friction = 0.1
+# Creates support tube as hollow cylinder at given location
+# Params:
+#   name - name for object
+#   loc_vec - location of object
+#   shared - use the shared support mesh; pass False if the mesh will be edited
+#   segments - number of sides; plain supports use fewer, since they are mostly
+#              hidden and their mesh collision shape is tested every physics step
+# Return:
+#   created object
+def create_support(name, loc_vec, shared=True, segments=12):
+    loc_vec_modded = mod_location(loc_vec)
 
-    deselect_all_meshes()
+    if shared:
+        me = support_mesh(segments)
+    else:
+        me = support_mesh(segments).copy()
+        me.name = name
+
+    obj = create_object(name, me, loc_vec_modded)
+
+    # Tube is hollow so marbles can fall through; an analytic shape would fill it in
+    add_rigid_body(obj, 'PASSIVE', collision_shape='MESH', friction=0.1)
 
     return obj
 
@@ -279,16 +540,16 @@ def create_support(name, loc_vec):
 def create_start_funnel(name, loc_vec):
     
     # Create support as basis of funnel shape
-    funnel = create_support(name, loc_vec)
+    funnel = create_support(name, loc_vec, shared=False, segments=32)
 
-    # Scale top out to create basic funnel shape
-    polygon_index_list = list(range(32, 64))
-    O.object.mode_set(mode="OBJECT")
-    for p_i in polygon_index_list:
-        funnel.data.polygons[p_i].select = True
-    O.object.mode_set(mode = 'EDIT')
-    O.transform.resize(value=(1.5, 1.5, 1))
-    O.object.mode_set(mode="OBJECT")
+    # Scale top rim out to create basic funnel shape
+    me = funnel.data
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3)
+    co[co[:, 2] > 0.5, :2] *= 1.5
+    me.vertices.foreach_set("co", co.ravel())
+    me.update()
 
     return funnel
 
@@ -301,43 +562,31 @@ def create_start_funnel(name, loc_vec):
 def create_end_collector(name, loc_vec):
 
     # Create support as basis of collector shape
-    collector  = create_support(name, loc_vec)
+    collector  = create_support(name, loc_vec, segments=32)
 
     # will use this to cut exit hole into support for marble to roll out of
-    hole_cutter = create_cylinder(name+"_hole_cutter", loc_vec)
-    select_object(hole_cutter.name)
-    O.transform.rotate(value=1.65, orient_axis='X', orient_type='GLOBAL')
-    O.transform.resize(value=(0.375,0.375,0.375))
-    O.transform.translate(value=(0,0.2,-0.15))
-    deselect_all_meshes()
-
-    select_object(hole_cutter.name)
-    bool_meshes(collector, hole_cutter, 'DIFFERENCE')
-    deselect_all_meshes()
-    select_object(hole_cutter.name)
-    O.object.delete()
+    hole_cutter = create_cutter(name+"_hole_cutter", loc_vec)
+    transform_object(hole_cutter, Matrix.Diagonal((0.375,0.375,0.375,1)) @ Matrix.Rotation(1.65, 4, 'X'),
+                     (0,0.2,-0.15))
+
+    bool_meshes(collector, hole_cutter, 'DIFFERENCE', solver='FAST')
+    D.objects.remove(hole_cutter)
 
     # Add small plane at an angle to make marble exit into collector base
-    p0 = create_plane(name+"_p0", [a-b for a,b in zip(loc_vec, [0,0,0.2])], 0.35, 0.4)
-    O.transform.rotate(value=0.5, orient_axis='X', orient_type='GLOBAL')
-    O.rigidbody.object_add(type='PASSIVE')
+    p0 = create_plane(name+"_p0", Vector(loc_vec) - Vector((0,0,0.2)), 0.35, 0.4)
+    transform_object(p0, Matrix.Rotation(0.5, 4, 'X'))
 
     unionize_meshes(collector, p0)
 
     # Create ring around support to keep marbles inside area
-    collector_bottom = create_support(name+"_bottom", loc_vec)
-    select_object(collector_bottom.name)
-    O.transform.resize(value=(3, 3, 0.3))
-    O.transform.translate(value=(0,0,-0.525))
-    deselect_all_meshes()
+    collector_bottom = create_support(name+"_bottom", loc_vec, segments=32)
+    transform_object(collector_bottom, Matrix.Diagonal((3, 3, 0.3, 1)), (0,0,-0.525))
 
     unionize_meshes(collector, collector_bottom)
 
     # Create small ramp in collector bottom area so marbles don't bunch near entrance
-    c0 = create_cylinder(name+"_c0", [a-b for a,b in zip(loc_vec, [0,0,0.425])])
-    O.transform.resize(value=(1.3,1.3,0.01))
-    O.transform.rotate(value=-0.08, orient_axis='X', orient_type='GLOBAL')
-    O.rigidbody.object_add(type='PASSIVE')
+    c0 = create_cylinder(name+"_c0", Vector(loc_vec) - Vector((0,0,0.425)))
+    transform_object(c0, Matrix.Rotation(-0.08, 4, 'X') @ Matrix.Diagonal((1.3,1.3,0.01,1)))
 
     unionize_meshes(collector, c0)
 
@@ -353,57 +602,103 @@ def create_end_collector(name, loc_vec):
 #   created object
 def create_track(name, loc_vec):
     track_length = 2.45
-    mod_loc_vec = [a + b for a, b in zip(loc_vec, [0,0,0])]
+    mod_loc_vec = Vector(loc_vec)
 
-    # Create track portion first
-    track = create_support(name, mod_loc_vec)
-
-    # Cut off top half of cylinder to create open track
-    select_object(track.name)
-    O.object.mode_set(mode = 'EDIT')
-    O.mesh.select_mode(type = 'EDGE')
-    O.mesh.select_all(action = 'SELECT')
-    O.mesh.bisect(plane_co=loc_vec, plane_no=(0, 1, 0), use_fill=True, clear_inner=True, clear_outer=False, xstart=287, xend=361, ystart=219, yend=217)
-    O.object.mode_set(mode = 'OBJECT')
-
-    O.transform.rotate(value=1.65, orient_axis='X', orient_type='GLOBAL')
-    O.transform.resize(value=(0.8,track_length+0.3,0.8))
-    O.transform.translate(value=(0,-0.25,0))
+    # End supports sit this far either side of the track's centre
+    end_offset = Vector((0, track_length-0.45, 0))
+    e0_loc_vec = mod_loc_vec - end_offset
+    e1_loc_vec = mod_loc_vec + end_offset
 
-    hole_cutter = create_cylinder(name+"_hole_cutter", mod_loc_vec)
-    select_object(hole_cutter.name)
-    O.transform.rotate(value=1.65, orient_axis='X', orient_type='GLOBAL')
-    O.transform.resize(value=(0.375,track_length-0.6,0.375))
-
-    # Create two end supports
-    e0 = create_support(name+"_e0", [a - b for a, b in zip(loc_vec, [0,track_length-0.45,0])])
-    e1 = create_support(name+"_e1", [a - b for a, b in zip(loc_vec, [0,0.45-track_length,0])])
+    # Create track portion first
+    track = create_support(name, mod_loc_vec, shared=False, segments=32)
+
+    # Cut off top half of cylinder to create open track; the cut plane runs
+    # through the track's origin, and the cut is closed with triangle_fill
+    # as mesh.bisect(use_fill=True) does
+    bm = bmesh.new()
+    bm.from_mesh(track.data)
+    geom = bm.verts[:] + bm.edges[:] + bm.faces[:]
+    ret = bmesh.ops.bisect_plane(bm, geom=geom, dist=1e-5, plane_co=(0, 0, 0), plane_no=(0, 1, 0),
+                                 clear_inner=True, clear_outer=False)
+    cut_edges = [e for e in ret['geom_cut'] if isinstance(e, bmesh.types.BMEdge)]
+    bmesh.ops.triangle_fill(bm, use_dissolve=True, edges=cut_edges, normal=(0, 1, 0))
+    bm.to_mesh(track.data)
+    bm.free()
+
+    transform_object(track, Matrix.Rotation(1.65, 4, 'X'), (0,-0.25,0))
+    resize_object(track, (0.8,track_length+0.3,0.8))
+
+    hole_cutter = create_cutter(name+"_hole_cutter", mod_loc_vec)
+    transform_object(hole_cutter, Matrix.Rotation(1.65, 4, 'X'))
+    resize_object(hole_cutter, (0.375,track_length-0.6,0.375))
+
+    # Create two end supports; these are visible and line up with the track,
+    # funnel and collector, so they keep the full side count
+    e0 = create_support(name+"_e0", e0_loc_vec, segments=32)
+    e1 = create_support(name+"_e1", e1_loc_vec, segments=32)
 
     # "Cut" holes in supports so marble can roll into one from the top, across track, down other.
-    select_object(hole_cutter.name)
-    bool_meshes(e0, hole_cutter, 'DIFFERENCE')
-    deselect_all_meshes()
-
-    select_object(hole_cutter.name)
-    bool_meshes(e1, hole_cutter, 'DIFFERENCE')
-    deselect_all_meshes()
+    bool_meshes(e0, hole_cutter, 'DIFFERENCE', solver='FAST')
+    bool_meshes(e1, hole_cutter, 'DIFFERENCE', solver='FAST')
 
-    select_object(hole_cutter.name)
-    O.object.delete()
+    D.objects.remove(hole_cutter)
 
     # Merge end supports to track to create single track object.
-    unionize_meshes(track, e0)
-    unionize_meshes(track, e1)
+    join_meshes(track, e0)
+    join_meshes(track, e1)
     
     # Add small plane at an angle inside start of track to add starting momentum
-    p0 = create_plane(name+"_p0", [a - b for a, b in zip(loc_vec, [0,track_length-0.45,0])], 0.35, 0.45)
-    O.transform.rotate(value=0.7, orient_axis='X', orient_type='GLOBAL')
-    O.rigidbody.object_add(type='PASSIVE')
+    p0 = create_plane(name+"_p0", e0_loc_vec, 0.35, 0.45)
+    transform_object(p0, Matrix.Rotation(0.7, 4, 'X'))
     
-    unionize_meshes(track, p0)
+    join_meshes(track, p0)
     
     return track
 
+# Piece types used in maze plans
+PIECE_SUPPORT, PIECE_TRACK, PIECE_FUNNEL, PIECE_COLLECTOR = range(4)
+
+# Creator and name prefix for each piece type
+_PIECE_CREATORS = {
+    PIECE_SUPPORT: (create_support, "S"),
+    PIECE_TRACK: (create_track, "T"),
+    PIECE_FUNNEL: (create_start_funnel, "F"),
+    PIECE_COLLECTOR: (create_end_collector, "E"),
+}
+
+# Plans maze layout without touching the scene
+# Params:
+#   Nothing
+# Return:
+#   Array with one (x, y, z, piece_type) row per piece, in maze coordinates
+def plan_maze():
+    plan = np.empty((4, 4), dtype=np.float32)
+    plan[0] = (0, 0, 0, PIECE_SUPPORT)
+    plan[1] = (0, 2, 1, PIECE_TRACK)
+    plan[2] = (0, 0, 2, PIECE_FUNNEL)
+    plan[3] = (0, 4, 0, PIECE_COLLECTOR)
+    return plan
+
+# Creates pieces in scene from a maze plan
+# Params:
+#   plan - array of (x, y, z, piece_type) rows, see plan_maze
+# Return:
+#   List of created pieces
+def build_maze(plan):
+    counts = dict.fromkeys(_PIECE_CREATORS, 0)
+    pieces = []
+
+    for x, y, z, piece_type in plan.tolist():
+        piece_type = int(piece_type)
+        creator, prefix = _PIECE_CREATORS[piece_type]
+        name = prefix + "_" + str(counts[piece_type])
+        counts[piece_type] += 1
+
+        logger.debug("Creating %s...", name)
+        pieces.append(creator(name, [x, y, z]))
+
+    return pieces
+
 def main():
     print("\n\n\n\n\nGenerating Marble Maze...")
 
@@ -425,54 +720,48 @@ def main():
     # A sphere (marble) should be able to roll down maze from start to end.
 
     # Set to object mode if it already isn't
-    try:
-        O.object.mode_set(mode='OBJECT', toggle=False)
-    except:
-        pass
+    if C.object and C.object.mode != 'OBJECT':
+        O.object.mode_set(mode='OBJECT')
 
     # Clear scene
     remove_all_meshes()
 
     base_size = 75
+    marble_count = 3
 
     # Details of camera to be used; placed at edge of plane, 4 times higher than biggest mountain level
     cam1_loc = [0, 0, 0]
     cam1_name = "Camera 1"
 
     # Delete and unlink camera 1 if it exists
-    try:
-        D.objects[cam1_name].select_set(True)
-        O.object.delete() 
-        O.outliner.id_operation(type='UNLINK')
-    except:
-        pass
+    cam = D.objects.get(cam1_name)
+    if cam is not None:
+        cam_data = cam.data
+        D.objects.remove(cam, do_unlink=True)
+        if cam_data.users == 0:
+            D.cameras.remove(cam_data, do_unlink=True)
 
     # Add camera 1 to scene
     # cam1 = add_camera("Camera 1", cam1_loc)
 
     # Create plane as base for maze
     base = create_plane("Base", [0,0,-0.5], base_size, base_size)
-    O.rigidbody.object_add(type='PASSIVE')
+    add_rigid_body(base, 'PASSIVE', collision_shape='BOX')
 
     # Point camera at maze
     # look_at(cam1, base.matrix_world.to_translation())
 
-    print("Creating supports...")
-    s_0 = create_support("S_0", [0,0,0])
-
-    print("Creating marble...")
-    m_0 = create_marble("M_0", [0,0,3], 0.275)
-    m_1 = create_marble("M_1", [0,0,4], 0.275)
-    m_2 = create_marble("M_2", [0,0,5], 0.275)
-
-    print("Creating track...")
-    t_0 = create_track("T_0", [0,2,1])
+    # Work out layout first, then create every piece from it
+    plan = plan_maze()
+    print("Creating", len(plan), "maze pieces...")
+    pieces = build_maze(plan)
 
-    print("Creating start funnel...")
-    f_0 = create_start_funnel("F_0", [0,0,2])
+    # Marbles are stacked one level apart above the funnel; they all share one mesh
+    print("Creating marbles...")
+    marbles = [create_marble("M_" + str(i), [0,0,3+i], 0.275) for i in range(marble_count)]
 
-    print("Creating end collector...")
-    c_0 = create_end_collector("E_0", [0,4,0])
+    print("Adding rigid bodies...")
+    apply_rigid_bodies()
 
     return
 